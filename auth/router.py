@@ -9,11 +9,11 @@ from auth.utils import (
 )
 from urllib.parse import urlencode
 import os
+import asyncio
 import logging
 
 # Setup logging
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG)
 
 router = APIRouter()
 
@@ -21,7 +21,7 @@ router = APIRouter()
 async def auth(request: Request):
     try:
         redirect_uri = str(request.url_for("auth_callback"))
-        logger.debug(f"Auth endpoint called. Redirect URI: {redirect_uri}")
+        logger.debug("Auth endpoint called. Redirect URI: %s", redirect_uri)
         
         auth_url = get_auth_url(redirect_uri)
         logger.info(f"Redirecting to Google auth URL: {auth_url}")
@@ -35,7 +35,7 @@ async def auth(request: Request):
 async def auth_callback(code: str, request: Request):
     try:
         redirect_uri = str(request.url_for("auth_callback"))
-        logger.debug(f"Received auth callback with code: {code}")
+        logger.debug("Received auth callback with code: %s", code)
         
         creds = get_creds_from_code(code, redirect_uri)
         
@@ -47,31 +47,33 @@ async def auth_callback(code: str, request: Request):
         
         frontend_url = os.getenv("FRONTEND_URL", "http://localhost:8501")
         success_url = f"{frontend_url}?auth_success=true"
-        logger.debug(f"Redirecting to frontend success URL: {success_url}")
+        logger.debug("Redirecting to frontend success URL: %s", success_url)
         
         return RedirectResponse(success_url)
     except Exception as e:
         logger.error(f"Authentication callback failed: {e}")
         frontend_url = os.getenv("FRONTEND_URL", "http://localhost:8501")
         error_url = f"{frontend_url}?auth_error={str(e)}"
-        logger.debug(f"Redirecting to frontend error URL: {error_url}")
+        logger.debug("Redirecting to frontend error URL: %s", error_url)
         return RedirectResponse(error_url)
 
 @router.get("/auth/status")
 async def auth_status(user_id: str = "user_123"):
     try:
-        logger.debug(f"Checking authentication status for user: {user_id}")
-        creds = load_credentials(user_id)
+        logger.debug("Checking authentication status for user: %s", user_id)
+        # Token file reads, per-user locks and the HTTPS refresh all block, so
+        # they run on a worker thread rather than the event loop
+        creds = await asyncio.to_thread(load_credentials, user_id)
         if not creds:
             logger.info(f"No credentials found for user {user_id}")
             return {"authenticated": False}
         
-        refreshed = refresh_credentials(creds)
+        refreshed = await asyncio.to_thread(refresh_credentials, creds)
         if refreshed:
             logger.info(f"Credentials refreshed for user {user_id}")
-            save_credentials(user_id, creds)
+            await asyncio.to_thread(save_credentials, user_id, creds)
         else:
-            logger.debug(f"No refresh needed for user {user_id}")
+            logger.debug("No refresh needed for user %s", user_id)
 
         return {
             "authenticated": True,
@@ -2,38 +2,89 @@ import os
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from google.auth.transport.requests import Request
+from google.auth.exceptions import RefreshError
+import requests
 from pathlib import Path
+from datetime import timezone
 import json
-from typing import Dict, Optional
+import tempfile
+import time
+import asyncio
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+from functools import lru_cache
+from cachetools import TLRUCache, TTLCache
 import logging
 
 # Configure logger
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG)
 
 # OAuth Scopes
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
+CLIENT_SECRET_PATH = Path(__file__).parent.parent / "client_secret.json"
+
+TOKENS_DIR = Path(__file__).parent.parent / "tokens"
+TOKENS_DIR.mkdir(exist_ok=True, parents=True)
+
+# Most users whose credentials and last access are kept in memory
+MAX_CACHED_USERS = 10_000
+
+def _creds_time_to_use(user_id: str, entry: Tuple[Credentials, float], now: float) -> float:
+    # An entry is dropped as soon as the token it holds has expired
+    return entry[1]
+
+# Parsed credentials per user, with the timestamp at which the token expires
+CREDS_EXPIRY_BUFFER = 300  # seconds
+_CREDS_CACHE: TLRUCache = TLRUCache(
+    maxsize=MAX_CACHED_USERS, ttu=_creds_time_to_use, timer=time.time
+)
+_CREDS_LOCK = threading.RLock()
+# Per-user locks serializing token file reads and writes; an entry lives only
+# while some caller holds it
+_USER_LOCKS: "weakref.WeakValueDictionary[str, threading.RLock]" = weakref.WeakValueDictionary()
+
+# Tokens further than this from expiry are never refreshed
+REFRESH_MARGIN = 60  # seconds
+
+# Shared transport for every token refresh, so they reuse one keep-alive
+# connection to Google's token endpoint
+HTTP_SESSION = requests.Session()
+HTTP_REQUEST = Request(session=HTTP_SESSION)
+
+# Cached tokens closer than this to expiry are refreshed by refresh_loop(),
+# but only for users who loaded them within ACTIVE_USER_WINDOW
+BACKGROUND_REFRESH_WINDOW = 300  # seconds
+ACTIVE_USER_WINDOW = 3600  # seconds
+# Users who called load_credentials within ACTIVE_USER_WINDOW
+_LAST_ACCESS: TTLCache = TTLCache(
+    maxsize=MAX_CACHED_USERS, ttl=ACTIVE_USER_WINDOW, timer=time.time
+)
+
+@lru_cache(maxsize=1)
+def _load_client_config() -> Dict:
+    """Read client_secret.json once; call _load_client_config.cache_clear() to reload"""
+    logger.debug("Loading OAuth client config from %s", CLIENT_SECRET_PATH)
+    return json.loads(CLIENT_SECRET_PATH.read_text())
+
 def get_flow(redirect_uri: str = None):
     try:
-        client_secret_path = Path(__file__).parent.parent / "client_secret.json"
-        logger.debug(f"Initializing OAuth flow with client secret at {client_secret_path}")
-        flow = Flow.from_client_secrets_file(
-            client_secret_path,
+        return Flow.from_client_config(
+            _load_client_config(),
             scopes=SCOPES,
             redirect_uri=redirect_uri
         )
-        return flow
     except Exception as e:
         logger.error(f"Error initializing OAuth flow: {e}")
         raise
 
 def get_auth_url(redirect_uri: str) -> str:
     try:
-        logger.debug(f"Generating auth URL with redirect_uri: {redirect_uri}")
+        logger.debug("Generating auth URL with redirect_uri: %s", redirect_uri)
         flow = get_flow(redirect_uri)
         auth_url, _ = flow.authorization_url(prompt='consent')
-        logger.info(f"Generated auth URL: {auth_url}")
+        logger.debug("Generated auth URL: %s", auth_url)
         return auth_url
     except Exception as e:
         logger.error(f"Failed to generate auth URL: {e}")
@@ -50,59 +101,166 @@ def get_creds_from_code(code: str, redirect_uri: str) -> Credentials:
         logger.error(f"Error fetching credentials from code: {e}")
         raise
 
+def _expiry_timestamp(creds: Credentials) -> float:
+    # google-auth stores expiry as a naive UTC datetime
+    if creds.expiry:
+        return creds.expiry.replace(tzinfo=timezone.utc).timestamp()
+    return time.time() + 3300
+
+def _user_lock(user_id: str) -> threading.RLock:
+    with _CREDS_LOCK:
+        lock = _USER_LOCKS.get(user_id)
+        if lock is None:
+            lock = _USER_LOCKS[user_id] = threading.RLock()
+        return lock
+
+def _cached_credentials(user_id: str) -> Optional[Credentials]:
+    with _CREDS_LOCK:
+        cached = _CREDS_CACHE.get(user_id)
+    if cached and _CREDS_CACHE.timer() < cached[1] - CREDS_EXPIRY_BUFFER:
+        return cached[0]
+    return None
+
+def _cache_credentials(user_id: str, creds: Credentials) -> None:
+    with _CREDS_LOCK:
+        _CREDS_CACHE[user_id] = (creds, _expiry_timestamp(creds))
+
 def save_credentials(user_id: str, creds: Credentials) -> None:
-    """Save credentials with better error handling"""
+    """Save credentials atomically via a temp file and rename"""
     try:
-        project_root = Path(__file__).parent.parent
-        tokens_dir = project_root / "tokens"
-        tokens_dir.mkdir(exist_ok=True, parents=True)
+        creds_file = TOKENS_DIR / f"{user_id}.json"
+        payload = creds.to_json()
 
-        if not tokens_dir.exists():
-            raise Exception(f"Failed to create tokens directory at {tokens_dir}")
+        with _user_lock(user_id):
+            # A unique temp file per save, so concurrent saves for the same user
+            # never write into or rename each other's file
+            fd, tmp_path = tempfile.mkstemp(dir=TOKENS_DIR, prefix=f".{user_id}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as tmp_file:
+                    tmp_file.write(payload)
+                os.replace(tmp_path, creds_file)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
 
-        creds_file = tokens_dir / f"{user_id}.json"
-        with open(creds_file, 'w') as f:
-            f.write(creds.to_json())
+            _cache_credentials(user_id, creds)
 
         logger.info(f"Credentials saved successfully for {user_id} at {creds_file}")
-        logger.debug(f"Saved credentials content: {creds.to_json()}")
+        logger.debug("Saved credentials content: %s", payload)
 
     except Exception as e:
         logger.error(f"Failed to save credentials for {user_id}: {str(e)}")
         raise
 
 def load_credentials(user_id: str) -> Optional[Credentials]:
+    """Load credentials, serving from the in-process cache until near expiry"""
     try:
-        creds_file = Path(__file__).parent.parent / "tokens" / f"{user_id}.json"
+        with _CREDS_LOCK:
+            _LAST_ACCESS[user_id] = True
 
-        if not creds_file.exists():
-            logger.warning(f"No credentials file found for user {user_id}")
-            return None
+        cached = _cached_credentials(user_id)
+        if cached:
+            return cached
 
-        logger.debug(f"Reading credentials from {creds_file}")
-        with open(creds_file, 'r') as f:
-            creds_info = json.load(f)
+        # Only callers for the same user wait on each other; the global lock
+        # is never held across file I/O
+        with _user_lock(user_id):
+            cached = _cached_credentials(user_id)
+            if cached:
+                return cached
 
-        if not creds_info:
-            logger.error(f"Empty credentials file for user {user_id}")
-            return None
+            creds_file = TOKENS_DIR / f"{user_id}.json"
+
+            logger.debug("Reading credentials from %s", creds_file)
+            try:
+                with open(creds_file, 'r') as f:
+                    creds_info = json.load(f)
+            except FileNotFoundError:
+                logger.warning(f"No credentials file found for user {user_id}")
+                return None
+
+            if not creds_info:
+                logger.error(f"Empty credentials file for user {user_id}")
+                return None
+
+            creds = Credentials.from_authorized_user_info(creds_info)
+            _cache_credentials(user_id, creds)
 
         logger.info(f"Credentials loaded successfully for user {user_id}")
-        return Credentials.from_authorized_user_info(creds_info)
+        return creds
 
     except Exception as e:
         logger.error(f"Error loading credentials for user {user_id}: {str(e)}")
         return None
 
+def get_valid_credentials(user_id: str) -> Optional[Credentials]:
+    """Load credentials, refreshing expired ones with at most one refresh per user at a time"""
+    creds = load_credentials(user_id)
+    if not creds or creds.valid:
+        return creds
+    if not creds.refresh_token:
+        return None
+
+    with _user_lock(user_id):
+        # Another request may have refreshed and saved while this one waited
+        creds = load_credentials(user_id)
+        if creds and not creds.valid and creds.refresh_token:
+            logger.info(f"Refreshing expired credentials for user {user_id}")
+            creds.refresh(HTTP_REQUEST)
+            save_credentials(user_id, creds)
+
+    return creds if creds and creds.valid else None
+
 def refresh_credentials(creds: Credentials) -> bool:
     try:
-        if creds and creds.expired and creds.refresh_token:
-            logger.info("Refreshing expired credentials...")
-            creds.refresh(Request())
-            logger.info("Credentials refreshed successfully.")
-            return True
-        logger.debug("No need to refresh credentials.")
-        return False
+        if (
+            not creds
+            or not creds.refresh_token
+            or not creds.expiry
+            or _expiry_timestamp(creds) - time.time() > REFRESH_MARGIN
+        ):
+            logger.debug("No need to refresh credentials.")
+            return False
+
+        logger.info("Refreshing expired credentials...")
+        creds.refresh(HTTP_REQUEST)
+        logger.info("Credentials refreshed successfully.")
+        return True
     except Exception as e:
         logger.error(f"Failed to refresh credentials: {e}")
         return False
+
+async def refresh_expiring_credentials() -> None:
+    """Refresh recently used cached tokens that expire within BACKGROUND_REFRESH_WINDOW"""
+    with _CREDS_LOCK:
+        # Drop expired entries first so iterating never hits one mid-expiry
+        _CREDS_CACHE.expire()
+        _LAST_ACCESS.expire()
+        entries = [(u, entry) for u, entry in _CREDS_CACHE.items() if u in _LAST_ACCESS]
+
+    for user_id, (creds, expires_at) in entries:
+        if not creds.refresh_token or expires_at - time.time() > BACKGROUND_REFRESH_WINDOW:
+            continue
+
+        try:
+            await asyncio.to_thread(creds.refresh, HTTP_REQUEST)
+            await asyncio.to_thread(save_credentials, user_id, creds)
+            logger.info(f"Background refresh succeeded for user {user_id}")
+        except RefreshError as e:
+            # Revoked or otherwise unusable; retrying every interval can't help,
+            # so forget it until the user loads or signs in again
+            with _CREDS_LOCK:
+                _CREDS_CACHE.pop(user_id, None)
+            logger.warning(f"Dropping cached credentials for user {user_id}: {e}")
+        except Exception as e:
+            logger.error(f"Background refresh failed for user {user_id}: {e}")
+
+async def refresh_loop(interval: float = 60) -> None:
+    """Run refresh_expiring_credentials() forever; started on app startup"""
+    while True:
+        try:
+            await refresh_expiring_credentials()
+        except Exception:
+            # One bad pass must not end the task for the rest of the process
+            logger.exception("Background credential refresh pass failed")
+        await asyncio.sleep(interval)
@@ -4,29 +4,98 @@ from langchain_core.callbacks import Callbacks, BaseCallbackManager
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_huggingface import ChatHuggingFace, HuggingFaceEndpoint
 from datetime import datetime, timedelta
+from collections import deque
 from langchain_core.messages import SystemMessage
 from huggingface_hub import login
 import re
 import json
 import os
-import dateparser
 import logging
-from pytz import timezone
-import pytz
+from zoneinfo import ZoneInfo
 
 from langgraph.graph import Graph
+from cachetools import LRUCache, TTLCache
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 HuggingFaceEndpoint.model_rebuild()
 ChatHuggingFace.model_rebuild()
 
+# Patterns used on every turn, compiled once
+_TIME_RE = re.compile(r"(\d{1,2})(?::(\d{2}))?\s*(am|pm)?")
+_RANGE_RE = re.compile(
+    r"between (\d+)(?::(\d+))?\s*(am|pm)?\s*(?:-|and)\s*(\d+)(?::(\d+))?\s*(am|pm)?"
+)
+_SEP_RE = re.compile(r"\b(to|until|through|thru|–|—)\b")
+_DUR_RE = re.compile(r"for (\d+)\s*(hour|hr|minute|min)")
+_TOKEN_RE = re.compile(r"[a-z]+")
+# First JSON object in an LLM reply, allowing one level of nesting
+_JSON_EXTRACT_RE = re.compile(r"\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}", re.DOTALL)
+
+# Intent keywords, matched against the tokenized message
+_BOOK_WORDS = frozenset({
+    "book", "books", "booking", "booked",
+    "schedule", "schedules", "scheduling", "scheduled",
+    "want", "wants", "wanted",
+})
+_INQUIRE_WORDS = frozenset({"free", "available"})
+_WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday")
+
+# Working memory kept per conversation; older turns are dropped
+MAX_HISTORY_MESSAGES = 40
+
+# Date phrases and formats understood by _parse_date
+_RELATIVE_DAYS = {
+    "today": 0,
+    "tomorrow": 1,
+    "day after tomorrow": 2,
+    "next week": 7,
+    "next month": 30,
+}
+_WEEKDAY_INDEX = {
+    "monday": 0, "tuesday": 1, "wednesday": 2,
+    "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6
+}
+# "next monday" -> (weekday index, whether today itself counts)
+_WEEKDAY_PHRASES = {
+    f"{prefix} {day}": (idx, prefix == "this")
+    for prefix in ("next", "this", "coming")
+    for day, idx in _WEEKDAY_INDEX.items()
+}
+_DATE_FORMATS = ("%Y-%m-%d", "%B %d, %Y", "%b %d, %Y", "%d %B %Y", "%d %b %Y")
+_YEARLESS_DATE_FORMATS = ("%B %d", "%b %d", "%d %B", "%d %b")
+
+# Seconds a user's available slots for a day are reused between turns
+SLOTS_CACHE_TTL = 30
+SLOTS_CACHE_SIZE = 10_000
+
+# Number of normalized messages whose LLM extraction result is kept
+EXTRACTION_CACHE_SIZE = 512
+
+# Conversations kept in memory; the least recently active are dropped first
+MAX_CONVERSATIONS = 10_000
+
+# Kept byte-identical across calls so the endpoint can reuse the prompt prefix
+_EXTRACT_INSTRUCTIONS = """Extract appointment details as JSON with:
+- intent (book/check/unsure)
+- date (today/tomorrow/YYYY-MM-DD)
+- time (HH:MM or description)
+- duration (minutes)
+- purpose (string)
+
+Examples:
+{"intent": "book", "date": "next tuesday", "time": "14:00", "duration": 30, "purpose": "meeting"}
+"""
+
 class BookingAgent:
     def __init__(self, calendar_service):
         self.calendar_service = calendar_service
-        self.conversations = {}
-        self.timezone = timezone('Asia/Kolkata')
+        self.conversations: LRUCache = LRUCache(maxsize=MAX_CONVERSATIONS)
+        self.timezone = ZoneInfo('Asia/Kolkata')
+        self._extraction_cache: LRUCache = LRUCache(maxsize=EXTRACTION_CACHE_SIZE)
+        self._extract_system_msg = SystemMessage(content=_EXTRACT_INSTRUCTIONS)
+        # (user_id, date, duration) -> available slots
+        self._slots_cache: TTLCache = TTLCache(maxsize=SLOTS_CACHE_SIZE, ttl=SLOTS_CACHE_TTL)
         
         logger.info("Initializing BookingAgent...")
 
@@ -98,12 +167,13 @@ class BookingAgent:
                 f"for a {details.get('purpose', 'meeting')}?"
             )
             
-            state["conversation_state"]["messages"].append(AIMessage(content=response))
+            self._add_ai_message(state["conversation_state"], response)
             return state
         except Exception as e:
             logger.error(f"Error generating inquiry response: {str(e)}")
-            state["conversation_state"]["messages"].append(
-                AIMessage(content="Sorry, I couldn't understand the date. Please try again.")
+            self._add_ai_message(
+                state["conversation_state"],
+                "Sorry, I couldn't understand the date. Please try again."
             )
             return state
     
@@ -113,8 +183,9 @@ class BookingAgent:
         
         state["conversation_state"].pop("booking", None)
         
-        is_booking = any(word in user_input for word in ["book", "schedule", "set up", "want"])
-        is_inquiry = any(word in user_input for word in ["free", "available", "have time"])
+        tokens = set(_TOKEN_RE.findall(user_input))
+        is_booking = bool(_BOOK_WORDS & tokens) or "set up" in user_input
+        is_inquiry = bool(_INQUIRE_WORDS & tokens) or "have time" in user_input
         
         if is_booking and details.get("date") and details.get("time"):
             return "check"
@@ -125,82 +196,96 @@ class BookingAgent:
         else:
             return "respond"
 
-    def process_message(self, message: str, user_id: str) -> str:
+    async def process_message(self, message: str, user_id: str, service: Any = None) -> str:
         if not user_id:
             logger.error("User ID cannot be None")
             return "Authentication error. Please sign in again."
 
-        try:
-            if user_id not in self.conversations:
-                self.conversations[user_id] = {
-                    "messages": [],
-                    "extracted_details": {},
-                    "state": "awaiting_input",
-                    "available_slots": [],
-                    "current_slot_index": 0
-                }
+        # Held locally: another user's turn may evict this entry from the
+        # LRU while the workflow is awaiting
+        conversation = self.conversations.get(user_id)
+        if conversation is None:
+            conversation = self.conversations[user_id] = {
+                "messages": deque(maxlen=MAX_HISTORY_MESSAGES),
+                "extracted_details": {},
+                "state": "awaiting_input",
+                "available_slots": [],
+                "current_slot_index": 0
+            }
 
+        try:
             initial_state = {
                 "user_id": user_id,
                 "user_input": message,
-                "conversation_state": self.conversations[user_id]
+                "conversation_state": conversation
             }
 
-            self.conversations[user_id]["messages"].append(HumanMessage(content=message))
+            conversation["messages"].append(HumanMessage(content=message))
+            # Replies are per turn; never fall back to an earlier turn's
+            conversation.pop("last_ai_message", None)
 
-            for step in self.workflow.stream(initial_state):
-                pass
+            # Calendar client the caller already resolved; only valid for this turn
+            conversation["service"] = service
 
-            last_message = next(
-                (msg.content for msg in reversed(self.conversations[user_id]["messages"])
-                if isinstance(msg, AIMessage)),
-                "Sorry, I didn't understand that."
-            )
-            
-            return last_message
+            await self.workflow.ainvoke(initial_state)
+
+            last_ai_message = conversation.get("last_ai_message")
+            if last_ai_message is None:
+                return "Sorry, I didn't understand that."
+
+            return last_ai_message.content
 
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
             return "Sorry, I encountered an error. Please try again."
-
-    def extract_details(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        finally:
+            conversation.pop("service", None)
+
+    def _add_ai_message(self, conversation_state: Dict[str, Any], content: str) -> None:
+        """Append an assistant reply and remember it for process_message"""
+        message = AIMessage(content=content)
+        conversation_state.setdefault(
+            "messages", deque(maxlen=MAX_HISTORY_MESSAGES)
+        ).append(message)
+        conversation_state["last_ai_message"] = message
+
+    async def extract_details(self, state: Dict[str, Any]) -> Dict[str, Any]:
         conversation_state = state["conversation_state"]
         user_input = state.get("user_input", "")
 
         try:
             if self.chat:
+                cache_key = " ".join(user_input.lower().split())
+                cached = self._extraction_cache.get(cache_key)
+                if cached is not None:
+                    conversation_state["extracted_details"] = dict(cached)
+                    return {
+                        "conversation_state": conversation_state,
+                        "user_id": state["user_id"],
+                        "user_input": state["user_input"]
+                    }
+
                 prompt = [
-                    SystemMessage(content="""Extract appointment details as JSON with:
-                    - intent (book/check/unsure)
-                    - date (today/tomorrow/YYYY-MM-DD)
-                    - time (HH:MM or description)
-                    - duration (minutes)
-                    - purpose (string)
-                    
-                    Examples:
-                    {"intent": "book", "date": "next tuesday", "time": "14:00", "duration": 30, "purpose": "meeting"}
-                    """ + user_input),
-                    HumanMessage(content="Extract details in JSON only, no additional text.")
+                    self._extract_system_msg,
+                    HumanMessage(
+                        content=f"Extract details in JSON only, no additional text.\nInput: {user_input}"
+                    )
                 ]
 
-                response = self.chat.invoke(prompt)
-                json_str = response.content.strip()
-                
-                if '```json' in json_str:
-                    json_str = json_str.split('```json')[1].split('```')[0].strip()
-                elif '```' in json_str:
-                    json_str = json_str.split('```')[1].strip()
-                elif '{' in json_str and '}' in json_str:
-                    json_str = json_str[json_str.index('{'):json_str.rindex('}')+1]
+                response = await self.chat.ainvoke(prompt)
+                json_match = _JSON_EXTRACT_RE.search(response.content)
+                if not json_match:
+                    return self._simple_extraction(state)
 
                 try:
-                    details = json.loads(json_str)
+                    details = json.loads(json_match.group(0))
                     details["date"] = details.get("date", "today")
                     details["time"] = details.get("time", "12:00")
                     details["duration"] = int(details.get("duration", 30))
                     details["purpose"] = details.get("purpose", "Meeting")
 
                     conversation_state["extracted_details"] = details
+                    self._extraction_cache[cache_key] = dict(details)
                 except json.JSONDecodeError:
                     return self._simple_extraction(state)
                 return {
@@ -224,11 +309,13 @@ class BookingAgent:
             "purpose": "Meeting"
         }
         
-        if "tomorrow" in user_input:
+        tokens = set(_TOKEN_RE.findall(user_input))
+        weekday = next((day for day in _WEEKDAYS if day in tokens), None)
+
+        if "tomorrow" in tokens:
             extracted["date"] = "tomorrow"
-        elif any(day in user_input for day in ["monday", "tuesday", "wednesday", "thursday", "friday"]):
-            extracted["date"] = "next " + [d for d in ["monday", "tuesday", "wednesday", "thursday", "friday"] 
-                                        if d in user_input][0]
+        elif weekday:
+            extracted["date"] = "next " + weekday
         elif "next week" in user_input:
             extracted["date"] = "next week"
         
@@ -239,7 +326,7 @@ class BookingAgent:
         elif "evening" in user_input:
             extracted["time"] = "17:00"
         else:
-            time_match = re.search(r"(\d{1,2})(?::(\d{2}))?\s*(am|pm)?", user_input)
+            time_match = _TIME_RE.search(user_input)
             if time_match:
                 hour = int(time_match.group(1))
                 minute = int(time_match.group(2) or 0)
@@ -252,10 +339,7 @@ class BookingAgent:
                 extracted["time"] = f"{hour:02d}:{minute:02d}"
         
         if "between" in user_input and ("-" in user_input or "and" in user_input):
-            range_match = re.search(
-                r"between (\d+)(?::(\d+))?\s*(am|pm)?\s*(?:-|and)\s*(\d+)(?::(\d+))?\s*(am|pm)?", 
-                user_input
-            )
+            range_match = _RANGE_RE.search(user_input)
             if range_match:
                 start_hour = int(range_match.group(1))
                 start_min = int(range_match.group(2) or 0)
@@ -284,14 +368,12 @@ class BookingAgent:
             "user_input": state["user_input"]
         }
 
-    def check_availability(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    async def check_availability(self, state: Dict[str, Any]) -> Dict[str, Any]:
         conversation_state = state.get("conversation_state", {})
         user_id = state.get("user_id")
 
         if not user_id:
-            conversation_state.setdefault("messages", []).append(
-                AIMessage(content="Authentication error. Please sign in again.")
-            )
+            self._add_ai_message(conversation_state, "Authentication error. Please sign in again.")
             return {"conversation_state": conversation_state}
 
         try:
@@ -303,11 +385,23 @@ class BookingAgent:
             start_time, end_time = self._parse_time(details["time"])
             duration = int(details.get("duration", 30))
 
-            all_slots = self.calendar_service.get_available_slots(user_id, date_str, duration)
+            key = (user_id, date_str, duration)
+            all_slots = self._slots_cache.get(key)
+            if all_slots is None:
+                all_slots = await self.calendar_service.get_available_slots(
+                    user_id, date_str, duration, service=conversation_state.get("service")
+                )
+                # An empty list is also what the service returns on errors
+                if all_slots:
+                    self._slots_cache[key] = all_slots
             
+            # Slot starts are ISO-8601 ("YYYY-MM-DDTHH:MM:SS+05:30") and the
+            # requested bounds "HH:MM", so the hours sit at fixed offsets
+            start_hour = int(start_time[:2])
+            end_hour = int(end_time[:2])
             filtered_slots = [
                 slot for slot in all_slots
-                if self._is_time_in_range(slot["start"], start_time, end_time)
+                if start_hour <= int(slot["start"][11:13]) < end_hour
             ]
 
             conversation_state.update({
@@ -323,8 +417,9 @@ class BookingAgent:
 
         except Exception as e:
             logger.error(f"check_availability failed: {str(e)}")
-            conversation_state.setdefault("messages", []).append(
-                AIMessage(content="Failed to check availability. Please try again.")
+            self._add_ai_message(
+                conversation_state,
+                "Failed to check availability. Please try again."
             )
             return {
                 "conversation_state": conversation_state,
@@ -332,20 +427,15 @@ class BookingAgent:
                 "user_input": state.get("user_input")
             }
 
-    def _is_time_in_range(self, slot_time: str, start: str, end: str) -> bool:
-        slot_hour = int(slot_time.split("T")[1].split(":")[0])
-        start_hour = int(start.split(":")[0])
-        end_hour = int(end.split(":")[0])
-        return start_hour <= slot_hour < end_hour
-
     def suggest_slots(self, state: Dict[str, Any]) -> Dict[str, Any]:
         conversation_state = state["conversation_state"]
         available_slots = conversation_state.get("available_slots", [])
         idx = conversation_state.get("current_slot_index", 0)
         
         if not available_slots:
-            conversation_state["messages"].append(
-                AIMessage(content="No available slots found for your requested time. Please try another time.")
+            self._add_ai_message(
+                conversation_state,
+                "No available slots found for your requested time. Please try another time."
             )
             return {
                 "conversation_state": conversation_state,
@@ -361,14 +451,13 @@ class BookingAgent:
                 f"Would this work for you? (Yes/No)"
             )
             
-            conversation_state.update({
-                "suggested_slot": slot,
-                "current_slot_index": idx + 1,
-                "messages": [AIMessage(content=response)]
-            })
+            conversation_state["suggested_slot"] = slot
+            conversation_state["current_slot_index"] = idx + 1
+            self._add_ai_message(conversation_state, response)
         else:
-            conversation_state["messages"].append(
-                AIMessage(content="No more available slots for your requested time. Please try another time.")
+            self._add_ai_message(
+                conversation_state,
+                "No more available slots for your requested time. Please try another time."
             )
         
         return {
@@ -377,14 +466,12 @@ class BookingAgent:
             "user_input": state["user_input"]
         }
 
-    def finalize_booking(self, state: Dict[str, Any]) -> Dict[str, Any]:
+    async def finalize_booking(self, state: Dict[str, Any]) -> Dict[str, Any]:
         conversation_state = state["conversation_state"]
         user_id = state.get("user_id")
         
         if not user_id:
-            conversation_state["messages"].append(
-                AIMessage(content="Authentication error. Please sign in again.")
-            )
+            self._add_ai_message(conversation_state, "Authentication error. Please sign in again.")
             return {
                 "conversation_state": conversation_state,
                 "user_id": state["user_id"],
@@ -392,8 +479,9 @@ class BookingAgent:
             }
             
         if "suggested_slot" not in conversation_state:
-            conversation_state["messages"].append(
-                AIMessage(content="No appointment slot selected. Please start over.")
+            self._add_ai_message(
+                conversation_state,
+                "No appointment slot selected. Please start over."
             )
             return {
                 "conversation_state": conversation_state,
@@ -405,14 +493,18 @@ class BookingAgent:
             slot = conversation_state["suggested_slot"]
             details = conversation_state.get("extracted_details", {})
             
-            booking = self.calendar_service.book_appointment(
+            booking = await self.calendar_service.book_appointment(
                 user_id,
                 slot["start"],
                 slot["end"],
-                details.get("purpose", "Meeting")
+                details.get("purpose", "Meeting"),
+                service=conversation_state.get("service")
             )
             
             conversation_state["booking"] = booking
+            if booking:
+                for key in [key for key in self._slots_cache if key[0] == user_id]:
+                    self._slots_cache.pop(key, None)
             return {
                 "conversation_state": conversation_state,
                 "user_id": state["user_id"],
@@ -421,8 +513,9 @@ class BookingAgent:
             
         except Exception as e:
             logger.error(f"Booking failed: {str(e)}")
-            conversation_state["messages"].append(
-                AIMessage(content="Failed to book appointment. Please try again.")
+            self._add_ai_message(
+                conversation_state,
+                "Failed to book appointment. Please try again."
             )
             return {
                 "conversation_state": conversation_state,
@@ -446,8 +539,10 @@ class BookingAgent:
         else:
             response = "How would you like to proceed?"
         
-        if not any(msg.content == response for msg in conv_state["messages"]):
-            conv_state["messages"].append(AIMessage(content=response))
+        # Only skip a reply this turn has already given; history now spans turns
+        last_ai_message = conv_state.get("last_ai_message")
+        if last_ai_message is None or last_ai_message.content != response:
+            self._add_ai_message(conv_state, response)
         
         return state
     
@@ -459,7 +554,7 @@ class BookingAgent:
         time_str = time_str.lower().strip()
         
         # Standardize separators
-        time_str = re.sub(r"\b(to|until|through|thru|–|—)\b", "-", time_str)
+        time_str = _SEP_RE.sub("-", time_str)
 
         # Named time periods
         named_times = {
@@ -482,7 +577,7 @@ class BookingAgent:
             return (self._normalize_time(start), self._normalize_time(end))
 
         # Handle duration specifications
-        duration_match = re.search(r"for (\d+)\s*(hour|hr|minute|min)", time_str)
+        duration_match = _DUR_RE.search(time_str)
         if duration_match:
             time_part = time_str[:duration_match.start()].strip()
             num = int(duration_match.group(1))
@@ -535,54 +630,54 @@ class BookingAgent:
         date_str = date_str.lower().strip()
 
         # Common relative phrases
-        relative_keywords = {
-            "today": 0,
-            "tomorrow": 1,
-            "day after tomorrow": 2,
-            "next week": 7,
-            "next month": 30,
-        }
-
-        if date_str in relative_keywords:
-            target_date = today + timedelta(days=relative_keywords[date_str])
+        if date_str in _RELATIVE_DAYS:
+            target_date = today + timedelta(days=_RELATIVE_DAYS[date_str])
             return target_date.strftime("%Y-%m-%d")
 
-        # Weekday references
-        weekdays = {
-            "monday": 0, "tuesday": 1, "wednesday": 2,
-            "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6
-        }
-
-        for prefix in ["next", "this", "coming"]:
-            for day, idx in weekdays.items():
-                if f"{prefix} {day}" in date_str:
-                    days_ahead = (idx - today.weekday() + (7 if prefix != "this" else 0)) % 7
-                    if days_ahead == 0 and prefix != "this":
-                        days_ahead = 7
-                    return (today + timedelta(days=days_ahead)).strftime("%Y-%m-%d")
-
-        # Natural language parsing
-        try:
-            parsed = dateparser.parse(
-                date_str,
-                settings={
-                    "TIMEZONE": str(self.timezone),
-                    "RETURN_AS_TIMEZONE_AWARE": False,
-                    "PREFER_DATES_FROM": "future"
-                }
+        # Weekday references; exact phrases are a dict hit, longer text a single scan
+        weekday = _WEEKDAY_PHRASES.get(date_str)
+        if weekday is None and date_str in _WEEKDAY_INDEX:
+            # A bare weekday name means its next occurrence, today included
+            weekday = (_WEEKDAY_INDEX[date_str], True)
+        if weekday is None:
+            weekday = next(
+                (value for phrase, value in _WEEKDAY_PHRASES.items() if phrase in date_str),
+                None
             )
-            if parsed:
-                return parsed.date().strftime("%Y-%m-%d")
-        except Exception as e:
-            logger.warning(f"Dateparser failed for '{date_str}': {str(e)}")
+
+        if weekday is not None:
+            idx, allow_today = weekday
+            days_ahead = (idx - today.weekday()) % 7
+            if days_ahead == 0 and not allow_today:
+                days_ahead = 7
+            return (today + timedelta(days=days_ahead)).strftime("%Y-%m-%d")
+
+        # Explicit dates
+        for fmt in _DATE_FORMATS:
+            try:
+                return datetime.strptime(date_str, fmt).strftime("%Y-%m-%d")
+            except ValueError:
+                continue
+
+        # Month and day without a year: the next such date. The year is parsed
+        # explicitly, since strptime's default of 1900 rejects Feb 29, and up to
+        # four years ahead so Feb 29 reaches the next leap year
+        for fmt in _YEARLESS_DATE_FORMATS:
+            for year in range(today.year, today.year + 5):
+                try:
+                    target = datetime.strptime(f"{date_str} {year}", f"{fmt} %Y").date()
+                except ValueError:
+                    continue
+                if target >= today:
+                    return target.strftime("%Y-%m-%d")
 
         raise ValueError(f"Invalid date format: '{date_str}'. Please use natural expressions or YYYY-MM-DD.")
 
     def _format_datetime(self, iso_str: str) -> str:
         try:
-            dt = datetime.fromisoformat(iso_str.replace('Z', ''))
+            dt = datetime.fromisoformat(iso_str[:-1] if iso_str.endswith('Z') else iso_str)
             if dt.tzinfo is None:
-                dt = self.timezone.localize(dt)
+                dt = dt.replace(tzinfo=self.timezone)
             return dt.strftime("%a %b %d, %I:%M %p")
         except ValueError:
             return iso_str
\ No newline at end of file
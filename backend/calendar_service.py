@@ -2,149 +2,373 @@
 
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
-from datetime import datetime, timedelta
-from typing import List, Dict
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
+from google_auth_httplib2 import AuthorizedHttp
+from datetime import datetime, timedelta, timezone
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, List, Dict, Optional, Tuple
 import logging
-from pytz import timezone
-import pytz
-import os  # Add this import
-from google.auth.transport.requests import Request  # Add this import
-from tenacity import retry, stop_after_attempt, wait_exponential
+import uuid
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
+from auth.utils import get_valid_credentials
+from cachetools import LRUCache, TTLCache
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on Google API / token file calls running at once
+MAX_BLOCKING_WORKERS = 10
+
+# Spacing between candidate slot start times
+SLOT_STEP_SECONDS = 15 * 60
+
+# Longest span get_available_slots_range fetches in one query
+MAX_RANGE_DAYS = 31
+# Most distinct durations it computes per day, and the longest one (the
+# whole 09:00-17:00 window)
+MAX_RANGE_DURATIONS = 8
+MAX_SLOT_MINUTES = 8 * 60
+
+# Seconds a user's busy blocks for a day are served from memory
+FREEBUSY_CACHE_TTL = 60
+
+# Upper bounds on per-user cache entries; the least recently used go first
+USER_CACHE_SIZE = 10_000
+SERVICE_CACHE_SIZE = 1000
+
+# Google API statuses worth retrying; anything else fails immediately
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+def _is_transient(exc: BaseException) -> bool:
+    return isinstance(exc, HttpError) and exc.resp.status in RETRYABLE_STATUSES
+
+@retry(
+    retry=retry_if_exception(_is_transient),
+    wait=wait_exponential_jitter(multiplier=0.25, max=4),
+    stop=stop_after_attempt(3),
+    reraise=True
+)
+def _execute_with_retry(request):
+    """Execute a single Google API request, retrying only transient HTTP errors"""
+    return request.execute(http=_thread_http(request.http.credentials))
+
+# httplib2.Http is not thread-safe, so the cached per-user clients never
+# execute over their own connection; each worker thread keeps one instead
+_thread_local = threading.local()
+
+def _thread_http(credentials: Credentials) -> AuthorizedHttp:
+    http = getattr(_thread_local, "http", None)
+    if http is None:
+        http = _thread_local.http = build_http()
+    return AuthorizedHttp(credentials, http=http)
+
+def _merge_intervals(intervals) -> List[Tuple[int, int]]:
+    """Sort (start, end) pairs and merge any that overlap or touch"""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def _overlaps_busy(busy_starts: List[int], busy_ends: List[int], start: int, end: int) -> bool:
+    """Check [start, end) against merged busy intervals split into starts and ends"""
+    # Intervals are disjoint, so only the last one starting before the
+    # slot ends can overlap it
+    idx = bisect_left(busy_starts, end) - 1
+    return idx >= 0 and busy_ends[idx] > start
+
 class GoogleCalendarService:
-    def __init__(self):
+    # Shared, immutable timezone constants
+    TZ_NAME = "Asia/Kolkata"
+    TZ = ZoneInfo(TZ_NAME)
+    UTC = timezone.utc
+
+    def __init__(self, timer: Callable[[], float] = time.monotonic):
         self.scopes = ['https://www.googleapis.com/auth/calendar']
-        self.timezone = timezone('Asia/Kolkata')
+        # (user_id, date) -> merged busy intervals
+        self._freebusy_cache: TTLCache = TTLCache(
+            maxsize=USER_CACHE_SIZE, ttl=FREEBUSY_CACHE_TTL, timer=timer
+        )
+        self._freebusy_lock = threading.RLock()
+        # user_id -> (Calendar API client, credentials it was built with)
+        self._services: LRUCache = LRUCache(maxsize=SERVICE_CACHE_SIZE)
+        self._services_lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=MAX_BLOCKING_WORKERS, thread_name_prefix="calendar"
+        )
+
+    async def _run_blocking(self, func, *args):
+        """Run a blocking call on the service's bounded thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def get_credentials(self, user_id: str) -> Credentials:
+        return await self._run_blocking(self._get_credentials, user_id)
+
+    async def get_service(self, user_id: str) -> Optional[Any]:
+        """Resolve a user's Calendar API client once so a request can reuse it"""
+        return await self._run_blocking(self._resolve_service, user_id)
+
+    async def get_available_slots(self, user_id: str, date: str, duration_minutes: int = 30,
+                                  service: Any = None) -> List[Dict]:
+        return await self._run_blocking(
+            self._get_available_slots_sync, user_id, date, duration_minutes, service
+        )
+
+    async def get_available_slots_range(self, user_id: str, date_from: str, date_to: str,
+                                        durations: List[int] = (30,)) -> Dict[str, Dict[int, List[Dict]]]:
+        """Available slots per date and duration for date_from..date_to inclusive"""
+        return await self._run_blocking(
+            self._get_available_slots_range_sync, user_id, date_from, date_to, list(durations)
+        )
+
+    async def book_appointment(self, user_id: str, start_time: str, end_time: str, summary: str = "Meeting",
+                               service: Any = None) -> Dict:
+        return await self._run_blocking(
+            self._book_appointment_sync, user_id, start_time, end_time, summary, service
+        )
         
     def _get_credentials(self, user_id: str) -> Credentials:
         try:
             if not user_id:
                 raise ValueError("User ID cannot be None")
 
-            os.makedirs("tokens", exist_ok=True)
-            token_file = f"tokens/{user_id}.json"
-            
-            # If token doesn't exist, return None to trigger re-auth
-            if not os.path.exists(token_file):
-                return None
-                
-            creds = Credentials.from_authorized_user_file(token_file, self.scopes)
-            
-            if not creds or not creds.valid:
-                if creds and creds.expired and creds.refresh_token:
-                    creds.refresh(Request())
-                    self._save_credentials(user_id, creds)
-                else:
-                    return None
-                    
-            return creds
+            # auth.utils owns the one write-through credentials cache, so a
+            # re-authentication or background refresh is seen here at once.
+            # None means there is no usable token and the user must re-auth
+            return get_valid_credentials(user_id)
         except Exception as e:
             logger.error(f"Authentication failed: {str(e)}")
             return None
 
 
-    def _save_credentials(self, user_id: str, creds: Credentials):
-        os.makedirs("tokens", exist_ok=True)
-        with open(f"tokens/{user_id}.json", "w") as token:
-            token.write(creds.to_json())
+    def _resolve_service(self, user_id: str) -> Optional[Any]:
+        creds = self._get_credentials(user_id)
+        if not creds:
+            return None
+        return self._get_service(user_id, creds)
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=4, max=10)
-    )
-    def get_available_slots(self, user_id: str, date: str, duration_minutes: int = 30) -> List[Dict]:
+    def _get_available_slots_sync(self, user_id: str, date: str, duration_minutes: int = 30,
+                                  service: Any = None) -> List[Dict]:
         try:
-            creds = self._get_credentials(user_id)
-            if not creds:
+            service = service or self._resolve_service(user_id)
+            if not service:
                 return []
 
-            service = build('calendar', 'v3', credentials=creds, static_discovery=False)
-            
-            start_datetime = datetime.strptime(date, "%Y-%m-%d").replace(
-                hour=9, minute=0, second=0, microsecond=0
-            )
-            start_datetime = self.timezone.localize(start_datetime)
-            end_datetime = start_datetime.replace(hour=17, minute=0)
-            
-            freebusy = service.freebusy().query(body={
-                "timeMin": start_datetime.astimezone(pytz.UTC).isoformat(),
-                "timeMax": end_datetime.astimezone(pytz.UTC).isoformat(),
-                "items": [{"id": "primary"}],
-                "timeZone": str(self.timezone)
-            }).execute()
-
-            busy_slots = freebusy['calendars']['primary']['busy']
-            slot_duration = timedelta(minutes=duration_minutes)
-            possible_slots = []
-            current_time = start_datetime
-
-            while current_time + slot_duration <= end_datetime:
-                possible_slots.append({
-                    "start": current_time.isoformat(),
-                    "end": (current_time + slot_duration).isoformat()
-                })
-                current_time += timedelta(minutes=15)
-
-            available_slots = []
-            for slot in possible_slots:
-                is_available = True
-                slot_start = datetime.fromisoformat(slot['start']).astimezone(pytz.UTC)
-                slot_end = datetime.fromisoformat(slot['end']).astimezone(pytz.UTC)
-                
-                for busy in busy_slots:
-                    busy_start = datetime.fromisoformat(busy['start'].replace('Z', '+00:00'))
-                    busy_end = datetime.fromisoformat(busy['end'].replace('Z', '+00:00'))
-                    
-                    if not (slot_end <= busy_start or slot_start >= busy_end):
-                        is_available = False
-                        break
-
-                if is_available:
-                    available_slots.append({
-                        "start": slot['start'],
-                        "end": slot['end'],
-                        "display": datetime.fromisoformat(slot['start']).strftime("%I:%M %p")
-                    })
-
-            return available_slots
+            start_ts, end_ts = self._day_window(date)
+            busy = self._get_busy_intervals(service, user_id, date, start_ts, end_ts)
+            return self._free_slots(start_ts, end_ts, duration_minutes, busy)
 
         except Exception as e:
             logger.error(f"Error retrieving available slots: {str(e)}")
             return []
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=4, max=10)
-    )
-    def book_appointment(self, user_id: str, start_time: str, end_time: str, summary: str = "Meeting") -> Dict:
+    def _get_available_slots_range_sync(self, user_id: str, date_from: str, date_to: str,
+                                        durations: List[int]) -> Dict[str, Dict[int, List[Dict]]]:
+        first = datetime.strptime(date_from, "%Y-%m-%d").date()
+        days = (datetime.strptime(date_to, "%Y-%m-%d").date() - first).days + 1
+        if not 0 < days <= MAX_RANGE_DAYS:
+            raise ValueError(f"Date range must cover between 1 and {MAX_RANGE_DAYS} days")
+
+        durations = list(dict.fromkeys(durations))
+        if not 0 < len(durations) <= MAX_RANGE_DURATIONS:
+            raise ValueError(f"Pass between 1 and {MAX_RANGE_DURATIONS} distinct durations")
+        if any(not 0 < duration <= MAX_SLOT_MINUTES for duration in durations):
+            raise ValueError(f"Durations must be between 1 and {MAX_SLOT_MINUTES} minutes")
+
         try:
-            creds = self._get_credentials(user_id)
-            if not creds:
+            service = self._resolve_service(user_id)
+            if not service:
                 return {}
 
-            service = build('calendar', 'v3', credentials=creds, static_discovery=False)
+            dates = [(first + timedelta(days=offset)).isoformat() for offset in range(days)]
+            windows = {date: self._day_window(date) for date in dates}
+            busy_by_date = self._get_busy_intervals_range(service, user_id, windows)
+
+            return {
+                date: {
+                    duration: self._free_slots(*windows[date], duration, busy_by_date[date])
+                    for duration in durations
+                }
+                for date in dates
+            }
+
+        except Exception as e:
+            logger.error(f"Error retrieving available slots for range: {str(e)}")
+            return {}
+
+    def _day_window(self, date: str) -> Tuple[int, int]:
+        """Return the 09:00-17:00 working window of a YYYY-MM-DD date in epoch seconds"""
+        start_datetime = datetime.strptime(date, "%Y-%m-%d").replace(
+            hour=9, tzinfo=self.TZ
+        )
+        return int(start_datetime.timestamp()), int(start_datetime.replace(hour=17).timestamp())
+
+    def _free_slots(self, start_ts: int, end_ts: int, duration_minutes: int,
+                    busy: List[Tuple[int, int]]) -> List[Dict]:
+        # All arithmetic is on integer epoch seconds; datetimes are only
+        # built for the slots that are returned
+        busy_starts = [start for start, _ in busy]
+        busy_ends = [end for _, end in busy]
+        duration_s = duration_minutes * 60
+
+        # Candidate starts form an arithmetic sequence; generate, filter and
+        # format them in a single pass
+        return [
+            self._slot_dict(slot_start_ts, slot_start_ts + duration_s)
+            for slot_start_ts in range(start_ts, end_ts - duration_s + 1, SLOT_STEP_SECONDS)
+            if not _overlaps_busy(busy_starts, busy_ends, slot_start_ts, slot_start_ts + duration_s)
+        ]
+
+    def _slot_dict(self, start_ts: int, end_ts: int) -> Dict:
+        slot_start = datetime.fromtimestamp(start_ts, self.TZ)
+        return {
+            "start": slot_start.isoformat(),
+            "end": datetime.fromtimestamp(end_ts, self.TZ).isoformat(),
+            "display": slot_start.strftime("%I:%M %p")
+        }
+
+    def _get_service(self, user_id: str, creds: Credentials):
+        """Return the user's Calendar client, rebuilding it when the credentials change"""
+        with self._services_lock:
+            cached = self._services.get(user_id)
+        if cached and cached[1] is creds:
+            return cached[0]
+
+        # The bundled discovery document avoids fetching and parsing it per build.
+        # Only the client is shared across threads; every call goes through
+        # _execute_with_retry, which supplies the thread's own connection
+        service = build('calendar', 'v3', credentials=creds, static_discovery=True)
+        with self._services_lock:
+            self._services[user_id] = (service, creds)
+        return service
+
+    def _get_busy_intervals(self, service: Any, user_id: str, date: str,
+                            start_ts: int, end_ts: int) -> List[Tuple[int, int]]:
+        """Return the day's merged busy intervals, querying FreeBusy only on a cache miss"""
+        key = (user_id, date)
+        with self._freebusy_lock:
+            cached = self._freebusy_cache.get(key)
+        if cached is not None:
+            return cached
+
+        busy = self._query_busy(service, start_ts, end_ts)
+        with self._freebusy_lock:
+            self._freebusy_cache[key] = busy
+        return busy
+
+    def _get_busy_intervals_range(self, service: Any, user_id: str,
+                                  windows: Dict[str, Tuple[int, int]]) -> Dict[str, List[Tuple[int, int]]]:
+        """Return merged busy intervals per date, fetching every uncached day in one query"""
+        busy_by_date = {}
+        with self._freebusy_lock:
+            for date in windows:
+                cached = self._freebusy_cache.get((user_id, date))
+                if cached is not None:
+                    busy_by_date[date] = cached
+
+        missing = [date for date in windows if date not in busy_by_date]
+        if not missing:
+            return busy_by_date
+
+        busy = self._query_busy(service, windows[missing[0]][0], windows[missing[-1]][1])
+        busy_ends = [end for _, end in busy]
+
+        # Slice each day's window out of the single response, clipped the same
+        # way a one-day query would be, and cache it per day
+        for date in missing:
+            window_start, window_end = windows[date]
+            day_busy = []
+            idx = bisect_right(busy_ends, window_start)
+            while idx < len(busy) and busy[idx][0] < window_end:
+                day_busy.append((max(busy[idx][0], window_start), min(busy[idx][1], window_end)))
+                idx += 1
+            busy_by_date[date] = day_busy
+
+        with self._freebusy_lock:
+            for date in missing:
+                self._freebusy_cache[(user_id, date)] = busy_by_date[date]
+        return busy_by_date
+
+    def _query_busy(self, service: Any, start_ts: int, end_ts: int) -> List[Tuple[int, int]]:
+        freebusy = _execute_with_retry(service.freebusy().query(body={
+            "timeMin": datetime.fromtimestamp(start_ts, self.UTC).isoformat(),
+            "timeMax": datetime.fromtimestamp(end_ts, self.UTC).isoformat(),
+            "items": [{"id": "primary"}],
+            "timeZone": self.TZ_NAME
+        }))
+
+        # Each block is parsed exactly once; callers cache the parsed form
+        busy = [
+            (
+                int(datetime.fromisoformat(block['start'].replace('Z', '+00:00')).timestamp()),
+                int(datetime.fromisoformat(block['end'].replace('Z', '+00:00')).timestamp())
+            )
+            for block in freebusy['calendars']['primary']['busy']
+        ]
+
+        # Drop blocks that don't reach into the queried window before sorting
+        return _merge_intervals(
+            (busy_start, busy_end) for busy_start, busy_end in busy
+            if busy_end > start_ts and busy_start < end_ts
+        )
+
+    def _invalidate_freebusy(self, user_id: str):
+        with self._freebusy_lock:
+            for key in [key for key in self._freebusy_cache if key[0] == user_id]:
+                self._freebusy_cache.pop(key, None)
+
+    def _book_appointment_sync(self, user_id: str, start_time: str, end_time: str, summary: str = "Meeting",
+                               service: Any = None) -> Dict:
+        try:
+            service = service or self._resolve_service(user_id)
+            if not service:
+                return {}
             
-            start_dt = datetime.fromisoformat(start_time.replace('Z', '')).astimezone(pytz.UTC)
-            end_dt = datetime.fromisoformat(end_time.replace('Z', '')).astimezone(pytz.UTC)
+            start_dt = datetime.fromisoformat(start_time.replace('Z', '')).astimezone(self.UTC)
+            end_dt = datetime.fromisoformat(end_time.replace('Z', '')).astimezone(self.UTC)
             
+            # A client-chosen id (hex is a subset of the base32hex Google
+            # requires) makes the insert idempotent: if a retried attempt
+            # follows one that was stored, Google answers 409 instead of
+            # creating a second event
+            event_id = uuid.uuid4().hex
             event = {
+                'id': event_id,
                 'summary': summary,
                 'start': {
                     'dateTime': start_dt.isoformat(),
-                    'timeZone': str(self.timezone)
+                    'timeZone': self.TZ_NAME
                 },
                 'end': {
                     'dateTime': end_dt.isoformat(),
-                    'timeZone': str(self.timezone)
+                    'timeZone': self.TZ_NAME
                 },
             }
 
-            event_result = service.events().insert(
-                calendarId='primary', 
-                body=event
-            ).execute()
+            try:
+                event_result = _execute_with_retry(service.events().insert(
+                    calendarId='primary', 
+                    body=event
+                ))
+            except HttpError as e:
+                if e.resp.status != 409:
+                    raise
+                event_result = _execute_with_retry(service.events().get(
+                    calendarId='primary',
+                    eventId=event_id
+                ))
+
+            # The new event makes any cached availability for this user stale
+            self._invalidate_freebusy(user_id)
 
             return {
                 "id": event_result['id'],
@@ -1,25 +1,33 @@
 
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from auth.router import router as auth_router
+from auth.utils import refresh_loop
 from pydantic import BaseModel, Field, field_validator
 from backend.agent import BookingAgent
 from backend.calendar_service import GoogleCalendarService
 import uvicorn
+import asyncio
 import logging
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from slowapi.middleware import SlowAPIMiddleware
 from dotenv import load_dotenv
 import os
+from typing import List
 
 # Load environment variables first
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
+# Only the angle brackets are escaped: the message is LLM input, not HTML, and
+# its extracted purpose becomes the Calendar event title ("Q&A sync" must not
+# be booked as "Q&amp;A sync")
+_HTML_ESCAPE = str.maketrans({'<': '&lt;', '>': '&gt;'})
+
 app = FastAPI()
 
 app.include_router(auth_router, prefix="/api")  # Remove the extra /auth
@@ -42,19 +50,28 @@ app.add_middleware(
 calendar_service = GoogleCalendarService()
 booking_agent = BookingAgent(calendar_service)
 
+@app.on_event("startup")
+async def start_credential_refresh():
+    # Refresh recently active users' tokens ahead of expiry, so their requests
+    # rarely need to refresh inline (idle users still refresh on their next request)
+    app.state.refresh_task = asyncio.create_task(refresh_loop())
+
+@app.on_event("shutdown")
+async def stop_credential_refresh():
+    app.state.refresh_task.cancel()
+
 class UserMessage(BaseModel):
     message: str = Field(..., min_length=1, max_length=500)
     user_id: str = Field(..., min_length=1, max_length=50)
     
     @field_validator('message')
     def sanitize_message(cls, v):
-        v = v.replace('<', '&lt;').replace('>', '&gt;')
-        return v.strip()
+        return v.translate(_HTML_ESCAPE).strip()
 
 @app.get("/auth/status")
 async def auth_status(user_id: str):
     try:
-        creds = calendar_service._get_credentials(user_id)
+        creds = await calendar_service.get_credentials(user_id)
         return {"authenticated": bool(creds)}
     except Exception as e:
         logger.error(f"Error checking auth status: {str(e)}")
@@ -64,15 +81,17 @@ async def auth_status(user_id: str):
 @limiter.limit("10/minute")
 async def chat(request: Request, user_message: UserMessage):
     try:
-        if not calendar_service._get_credentials(user_message.user_id):
+        service = await calendar_service.get_service(user_message.user_id)
+        if not service:
             raise HTTPException(
                 status_code=401,
                 detail="Please authenticate with Google Calendar first"
             )
         
-        response = booking_agent.process_message(
+        response = await booking_agent.process_message(
             user_message.message, 
-            user_message.user_id
+            user_message.user_id,
+            service=service
         )
         return {"response": response}
     except HTTPException:
@@ -88,11 +107,31 @@ async def chat(request: Request, user_message: UserMessage):
 @limiter.limit("10/minute")
 async def get_available_slots(request: Request, user_id: str, date: str, duration: int = 30):
     try:
-        slots = calendar_service.get_available_slots(user_id, date, duration)
+        slots = await calendar_service.get_available_slots(user_id, date, duration)
         return {"slots": slots}
     except Exception as e:
         logger.error(f"Error fetching available slots: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/available-slots/range")
+@limiter.limit("10/minute")
+async def get_available_slots_range(
+    request: Request,
+    user_id: str,
+    start_date: str,
+    end_date: str,
+    durations: List[int] = Query([30])
+):
+    try:
+        slots = await calendar_service.get_available_slots_range(
+            user_id, start_date, end_date, durations
+        )
+        return {"slots": slots}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error fetching available slots for range: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
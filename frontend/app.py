@@ -1,7 +1,10 @@
 
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import time
 from dotenv import load_dotenv
 import webbrowser
 import logging
@@ -23,18 +26,48 @@ if "user_id" not in st.session_state:
 if "authenticated" not in st.session_state:
     st.session_state.authenticated = False
 
+# A successful auth check is trusted for this long before asking the backend again
+AUTH_CHECK_TTL = 30  # seconds
+if "auth_checked_at" not in st.session_state:
+    st.session_state.auth_checked_at = 0.0
+
 backend_url = os.getenv("BACKEND_URL", "http://localhost:8000")
 
+@st.cache_resource
+def get_session() -> requests.Session:
+    """One pooled keep-alive session shared across reruns"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=10,
+        max_retries=Retry(total=2, backoff_factor=0.2)
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+def invalidate_auth():
+    st.session_state.authenticated = False
+    st.session_state.auth_checked_at = 0.0
+
 def check_auth():
+    if (
+        st.session_state.authenticated
+        and time.time() - st.session_state.auth_checked_at < AUTH_CHECK_TTL
+    ):
+        return True
+
     try:
-        response = requests.get(
+        response = get_session().get(
             f"{backend_url}/api/auth/status",
             params={"user_id": st.session_state.user_id},
-            timeout=5
+            timeout=(2, 10)
         )
         if response.status_code == 200:
             auth_status = response.json()
             st.session_state.authenticated = auth_status.get("authenticated", False)
+            st.session_state.auth_checked_at = time.time()
             if not st.session_state.authenticated and auth_status.get("error"):
                 st.error(f"Auth error: {auth_status['error']}")
             return st.session_state.authenticated
@@ -45,11 +78,12 @@ def check_auth():
 
 
 def authenticate():
+    invalidate_auth()
     auth_url = f"{backend_url}/api/auth?user_id={st.session_state.user_id}"  # Removed duplicate /auth
     webbrowser.open_new_tab(auth_url)
 
 if st.session_state.authenticated and st.sidebar.button("Logout"):
-    st.session_state.authenticated = False
+    invalidate_auth()
     st.session_state.messages = []
     st.experimental_rerun()
 
@@ -69,13 +103,13 @@ if prompt := st.chat_input("How can I help you book an appointment?"):
         st.markdown(prompt)
 
     try:
-        response = requests.post(
+        response = get_session().post(
             f"{backend_url}/chat",
             json={
                 "message": prompt,
                 "user_id": st.session_state.user_id
             },
-            timeout=30
+            timeout=(2, 30)
         )
 
         if response.status_code == 401:
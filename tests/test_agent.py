@@ -0,0 +1,67 @@
+"""Multi-turn BookingAgent conversations against a stubbed LLM and calendar"""
+import asyncio
+import json
+
+from langchain_core.messages import AIMessage
+
+from backend import agent as agent_module
+from backend.agent import BookingAgent
+
+PROCEED = "How would you like to proceed?"
+BOOKED = "✅ Appointment booked!"
+
+
+class FakeChat:
+    async def ainvoke(self, prompt):
+        user_input = prompt[-1].content.rsplit("Input: ", 1)[1]
+        if "book" in user_input:
+            details = {"intent": "book", "date": "tomorrow", "time": "14:00",
+                       "duration": 30, "purpose": "sync"}
+        else:
+            details = {"intent": "unsure", "date": "", "time": ""}
+        return AIMessage(content=json.dumps(details))
+
+
+class FakeCalendar:
+    def __init__(self):
+        self.bookings = []
+
+    async def get_available_slots(self, user_id, date, duration_minutes=30, service=None):
+        return [{
+            "start": f"{date}T14:00:00+05:30",
+            "end": f"{date}T14:30:00+05:30",
+            "display": "02:00 PM"
+        }]
+
+    async def book_appointment(self, user_id, start_time, end_time, summary="Meeting", service=None):
+        self.bookings.append(start_time)
+        return {"id": "evt", "htmlLink": "https://calendar.example/evt",
+                "start": start_time, "end": end_time}
+
+
+def _agent(monkeypatch):
+    monkeypatch.setenv("HUGGINGFACEHUB_API_TOKEN", "test-token")
+    monkeypatch.setattr("huggingface_hub.login", lambda **kwargs: None)
+    monkeypatch.setattr(agent_module, "HuggingFaceEndpoint", lambda **kwargs: None)
+    monkeypatch.setattr(agent_module, "ChatHuggingFace", lambda llm: FakeChat())
+    calendar = FakeCalendar()
+    return BookingAgent(calendar), calendar
+
+
+def test_each_turn_returns_its_own_reply(monkeypatch):
+    agent, calendar = _agent(monkeypatch)
+    turns = [
+        "book a sync tomorrow 2pm",
+        "hmm ok",
+        "book a sync tomorrow 2pm",
+        "hmm ok 2",
+    ]
+
+    replies = [asyncio.run(agent.process_message(message, "user")) for message in turns]
+
+    assert replies[0].startswith(BOOKED)
+    assert replies[1] == PROCEED
+    assert replies[2].startswith(BOOKED)
+    # Must not replay the previous turn's booking confirmation
+    assert replies[3] == PROCEED
+    assert len(calendar.bookings) == 2
@@ -0,0 +1,32 @@
+"""Input validation for GoogleCalendarService.get_available_slots_range"""
+import pytest
+
+from backend.calendar_service import MAX_RANGE_DURATIONS, MAX_SLOT_MINUTES, GoogleCalendarService
+
+
+@pytest.mark.parametrize("durations", [
+    [],
+    [0],
+    [-30],
+    [MAX_SLOT_MINUTES + 1],
+    list(range(1, MAX_RANGE_DURATIONS + 2)),
+])
+def test_rejects_bad_durations(durations):
+    service = GoogleCalendarService()
+    with pytest.raises(ValueError):
+        service._get_available_slots_range_sync("user", "2030-01-07", "2030-01-08", durations)
+
+
+def test_rejects_ranges_past_the_cap():
+    service = GoogleCalendarService()
+    with pytest.raises(ValueError):
+        service._get_available_slots_range_sync("user", "2030-01-01", "2030-03-01", [30])
+
+
+def test_duplicate_durations_count_once(monkeypatch):
+    service = GoogleCalendarService()
+    monkeypatch.setattr(service, "_resolve_service", lambda user_id: None)
+    # Resolving no service means an unauthenticated user, after validation passed
+    assert service._get_available_slots_range_sync(
+        "user", "2030-01-07", "2030-01-07", [30] * (MAX_RANGE_DURATIONS + 1)
+    ) == {}
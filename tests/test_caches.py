@@ -0,0 +1,164 @@
+"""Reuse-before-expiry / reload-after-expiry checks for the in-memory caches"""
+from datetime import datetime, timezone
+
+from cachetools import TLRUCache
+
+from auth import utils
+from backend.calendar_service import FREEBUSY_CACHE_TTL, GoogleCalendarService
+
+DATE = "2030-01-07"
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_900_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class FakeCreds:
+    def __init__(self, expiry=None):
+        self.valid = True
+        self.expiry = expiry
+        self.refresh_token = "refresh"
+
+    def to_json(self) -> str:
+        return '{"token": "t"}'
+
+
+def _service_with_counted_queries(monkeypatch, clock):
+    service = GoogleCalendarService(timer=clock)
+    calls = []
+
+    def fake_query(api, start_ts, end_ts):
+        calls.append((start_ts, end_ts))
+        return [(start_ts, start_ts + 1800)]
+
+    monkeypatch.setattr(service, "_query_busy", fake_query)
+    return service, calls
+
+
+def test_freebusy_reused_before_expiry_and_reloaded_after(monkeypatch):
+    clock = FakeClock()
+    service, calls = _service_with_counted_queries(monkeypatch, clock)
+    start_ts, end_ts = service._day_window(DATE)
+
+    service._get_busy_intervals(None, "user", DATE, start_ts, end_ts)
+    clock.advance(FREEBUSY_CACHE_TTL - 1)
+    service._get_busy_intervals(None, "user", DATE, start_ts, end_ts)
+    assert len(calls) == 1
+
+    clock.advance(2)
+    service._get_busy_intervals(None, "user", DATE, start_ts, end_ts)
+    assert len(calls) == 2
+
+
+def test_freebusy_invalidated_for_user_only(monkeypatch):
+    clock = FakeClock()
+    service, calls = _service_with_counted_queries(monkeypatch, clock)
+    start_ts, end_ts = service._day_window(DATE)
+
+    service._get_busy_intervals(None, "user", DATE, start_ts, end_ts)
+    service._get_busy_intervals(None, "other", DATE, start_ts, end_ts)
+    service._invalidate_freebusy("user")
+
+    service._get_busy_intervals(None, "user", DATE, start_ts, end_ts)
+    service._get_busy_intervals(None, "other", DATE, start_ts, end_ts)
+    assert len(calls) == 3
+
+
+def test_range_lookup_fills_and_reuses_per_day_cache(monkeypatch):
+    clock = FakeClock()
+    service, calls = _service_with_counted_queries(monkeypatch, clock)
+    windows = {date: service._day_window(date) for date in ("2030-01-07", "2030-01-08")}
+
+    service._get_busy_intervals_range(None, "user", windows)
+    service._get_busy_intervals(None, "user", "2030-01-08", *windows["2030-01-08"])
+    assert len(calls) == 1
+
+    clock.advance(FREEBUSY_CACHE_TTL + 1)
+    service._get_busy_intervals_range(None, "user", windows)
+    assert len(calls) == 2
+
+
+def _isolated_auth_cache(monkeypatch, tmp_path, clock):
+    monkeypatch.setattr(utils, "TOKENS_DIR", tmp_path)
+    monkeypatch.setattr(utils, "_CREDS_CACHE", TLRUCache(
+        maxsize=utils.MAX_CACHED_USERS, ttu=utils._creds_time_to_use, timer=clock
+    ))
+
+
+def test_calendar_sees_credentials_saved_by_auth(monkeypatch, tmp_path):
+    clock = FakeClock()
+    _isolated_auth_cache(monkeypatch, tmp_path, clock)
+    service = GoogleCalendarService(timer=clock)
+    expiry = datetime.fromtimestamp(clock.now + 3600, timezone.utc).replace(tzinfo=None)
+
+    old, new = FakeCreds(expiry=expiry), FakeCreds(expiry=expiry)
+    utils.save_credentials("user", old)
+    assert service._get_credentials("user") is old
+
+    # e.g. the user re-authenticated through /api/auth/callback
+    utils.save_credentials("user", new)
+    assert service._get_credentials("user") is new
+
+
+def test_expired_credentials_refreshed_once(monkeypatch, tmp_path):
+    clock = FakeClock()
+    _isolated_auth_cache(monkeypatch, tmp_path, clock)
+    expiry = datetime.fromtimestamp(clock.now + 3600, timezone.utc).replace(tzinfo=None)
+
+    creds = FakeCreds(expiry=expiry)
+    creds.valid = False
+    refreshes = []
+
+    def fake_refresh(request):
+        refreshes.append(request)
+        creds.valid = True
+
+    creds.refresh = fake_refresh
+    utils.save_credentials("user", creds)
+
+    assert utils.get_valid_credentials("user") is creds
+    assert utils.get_valid_credentials("user") is creds
+    assert len(refreshes) == 1
+
+
+def test_auth_credentials_reused_until_expiry_buffer(monkeypatch, tmp_path):
+    clock = FakeClock()
+    _isolated_auth_cache(monkeypatch, tmp_path, clock)
+    (tmp_path / "user.json").write_text('{"token": "t"}')
+
+    # google-auth keeps expiry as a naive UTC datetime
+    expiry = datetime.fromtimestamp(clock.now + 3600, timezone.utc).replace(tzinfo=None)
+    loads = []
+
+    def fake_from_info(info):
+        loads.append(info)
+        return FakeCreds(expiry=expiry)
+
+    monkeypatch.setattr(utils.Credentials, "from_authorized_user_info", fake_from_info)
+
+    first = utils.load_credentials("user")
+    clock.advance(3600 - utils.CREDS_EXPIRY_BUFFER - 1)
+    assert utils.load_credentials("user") is first
+    assert len(loads) == 1
+
+    clock.advance(2)
+    utils.load_credentials("user")
+    assert len(loads) == 2
+
+
+def test_auth_credentials_evicted_once_token_expires(monkeypatch):
+    clock = FakeClock()
+    cache = TLRUCache(maxsize=utils.MAX_CACHED_USERS, ttu=utils._creds_time_to_use, timer=clock)
+    cache["user"] = (FakeCreds(), clock.now + 60)
+
+    clock.advance(59)
+    assert "user" in cache
+    clock.advance(2)
+    assert "user" not in cache